@@ -0,0 +1,174 @@
+from os import path, remove, scandir, utime
+from time import time
+from hashlib import sha1
+from json import load
+from threading import Lock
+from collections import OrderedDict
+from typing import Any, Optional
+from modules.jsonio import dump_atomic
+
+class ChronAmPageCache:
+    """Stores decoded pages of search results so that repeated or resumed queries don't re-download them from the [loc.gov newspaper API](https://libraryofcongress.github.io/data-exploration/loc.gov%20JSON%20API/Chronicling_America/README.html).
+
+    Pages are keyed by the full page URL, which encodes every query parameter along with the page number and page size,
+    so changing a query's parameters never returns stale pages. Pages are always kept in memory; if `cache_dir` is provided they are also written to disk
+    so that they survive between sessions.
+
+    If the API sent an `ETag` or `Last-Modified` header with a page, these are kept alongside it; once the page goes stale, `conditional_headers`
+    returns the headers for revalidating it, and a `304 Not Modified` response can be answered with `get(url, allow_stale=True)` and `refresh`.
+
+    Attributes:
+        cache_dir      (str | None) : an optional directory to write cached pages to, one JSON file per page URL.
+        max_age        (float)      : the number of seconds after which a cached page is considered stale; `0` to never expire.
+        max_pages      (int)        : the number of pages to keep in memory, evicting the least recently used; `0` for no limit.
+        max_disk_pages (int)        : the number of pages to keep in `cache_dir`, evicting the least recently written; `0` for no limit.
+        _pages         (OrderedDict[str, tuple[float, dict[str, Any], dict[str, str]]]) : a mapping of page URLs to the time each page was cached, the page itself, and its revalidation headers, least recently used first.
+        _disk_pages    (int | None) : the number of pages in `cache_dir`, counted on the first write; `None` until then.
+        _lock          (Lock)       : provisions access to `_pages` and `_disk_pages`.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, max_age: float = 86400, max_pages: int = 512, max_disk_pages: int = 4096) -> None:
+        """Initializes the object and validates attributes where applicable. Raises FileNotFoundError if `cache_dir` is not a directory."""
+        if cache_dir is not None and not path.isdir(cache_dir):
+            raise FileNotFoundError(f'ERROR: provided cache directory {cache_dir} is not a directory.')
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+        self.max_pages = max_pages
+        self.max_disk_pages = max_disk_pages
+        self._pages: OrderedDict[str, tuple[float, dict[str, Any], dict[str, str]]] = OrderedDict()
+        self._disk_pages: Optional[int] = None
+        self._lock = Lock()
+
+    def url_to_path(self, url: str) -> str:
+        """Returns the path to the cache file associated with the provided page URL. Raises ValueError if the cache has no `cache_dir`."""
+        if self.cache_dir is None:
+            raise ValueError('ERROR: cache has no cache directory.')
+        return path.join(self.cache_dir, f'{sha1(url.encode()).hexdigest()}.json')
+
+    def _scan_disk(self) -> list[tuple[float, str]]:
+        """Returns the modification time and path of every page file in `cache_dir`, skipping temporary files and anything not written by this class."""
+        entries = []
+        with scandir(self.cache_dir) as it:
+            for entry in it:
+                name = entry.name
+                if len(name) == 45 and name.endswith('.json') and all(c in '0123456789abcdef' for c in name[:40]):
+                    try:
+                        entries.append((entry.stat().st_mtime, entry.path))
+                    except FileNotFoundError:
+                        pass
+        return entries
+
+    def _evict_disk(self) -> None:
+        """Removes the least recently written page files once `cache_dir` holds more than `max_disk_pages`. Must be called with `_lock` held."""
+        if self._disk_pages is None:
+            self._disk_pages = len(self._scan_disk())
+        if not self.max_disk_pages or self._disk_pages <= self.max_disk_pages:
+            return
+
+        # evict a tenth of the limit at once so that the directory is not rescanned on every write
+        entries = sorted(self._scan_disk())
+        n_evict = max(len(entries) - self.max_disk_pages + self.max_disk_pages // 10, 0)
+        for _, filepath in entries[:n_evict]:
+            try:
+                remove(filepath)
+            except FileNotFoundError:
+                pass
+        self._disk_pages = len(entries) - n_evict
+
+    def _is_fresh(self, cached_at: float) -> bool:
+        """Returns whether a page cached at `cached_at` has not yet expired."""
+        return not self.max_age or time() - cached_at <= self.max_age
+
+    def _remember(self, url: str, cached_at: float, page: dict[str, Any], headers: dict[str, str]) -> None:
+        """Stores `page` in memory, evicting the least recently used page if `max_pages` is exceeded."""
+        with self._lock:
+            self._pages[url] = (cached_at, page, headers)
+            self._pages.move_to_end(url)
+            if self.max_pages and len(self._pages) > self.max_pages:
+                self._pages.popitem(last=False)
+
+    def _load(self, url: str) -> Optional[tuple[float, dict[str, Any], dict[str, str]]]:
+        """Returns the entry for `url` from memory or, failing that, from disk; `None` if there is none."""
+        with self._lock:
+            entry = self._pages.get(url)
+            if entry is not None:
+                self._pages.move_to_end(url)
+                return entry
+        if self.cache_dir is None:
+            return None
+
+        filepath = self.url_to_path(url)
+        try:
+            cached_at = path.getmtime(filepath)
+            with open(filepath, 'r') as fp:
+                cached = load(fp)
+            page, headers = cached['page'], cached['headers']
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+        self._remember(url, cached_at, page, headers)
+        return cached_at, page, headers
+
+    def get(self, url: str, allow_stale: bool = False) -> Optional[dict[str, Any]]:
+        """Returns the cached page for `url`, or `None` if it is missing or, unless `allow_stale=True`, stale."""
+        entry = self._load(url)
+        if entry is None or not (allow_stale or self._is_fresh(entry[0])):
+            return None
+        return entry[1]
+
+    def conditional_headers(self, url: str) -> dict[str, str]:
+        """Returns the `If-None-Match` and `If-Modified-Since` request headers for revalidating the page cached for `url`; empty if there is nothing to revalidate."""
+        entry = self._load(url)
+        return entry[2] if entry is not None else {}
+
+    def put(self, url: str, page: dict[str, Any], etag: Optional[str] = None, last_modified: Optional[str] = None) -> None:
+        """Writes `page` to the cache for `url`, along with the `ETag` and `Last-Modified` response headers if the API sent them."""
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+
+        self._remember(url, time(), page, headers)
+        if self.cache_dir is None:
+            return
+
+        # the revalidation headers are stored in the same file as the page, so each page takes a single file
+        filepath = self.url_to_path(url)
+        is_new = not path.exists(filepath)
+        dump_atomic({'page': page, 'headers': headers}, filepath)
+
+        with self._lock:
+            if is_new and self._disk_pages is not None:
+                self._disk_pages += 1
+            self._evict_disk()
+
+    def refresh(self, url: str) -> None:
+        """Marks the page cached for `url` as fresh again, e.g. after the API confirms that it has not been modified."""
+        now = time()
+        with self._lock:
+            entry = self._pages.get(url)
+            if entry is not None:
+                self._pages[url] = (now, entry[1], entry[2])
+        if self.cache_dir is None:
+            return
+
+        try:
+            utime(self.url_to_path(url), (now, now))
+        except FileNotFoundError:
+            pass
+
+    def invalidate(self, url: str) -> None:
+        """Removes the cached page for `url`, if present."""
+        with self._lock:
+            self._pages.pop(url, None)
+        if self.cache_dir is None:
+            return
+
+        try:
+            remove(self.url_to_path(url))
+        except FileNotFoundError:
+            return
+        with self._lock:
+            if self._disk_pages is not None:
+                self._disk_pages -= 1
@@ -1,40 +1,65 @@
-from os import walk, path, makedirs
+from os import scandir, path, makedirs
+from logging import getLogger
 from PIL import Image
 from json import load
-from typing import Union
+from typing import Optional, Union
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+logger = getLogger(__name__)
 
 class ChronAmJP2Clipper:
-    """Uses JSON files produced using the `ChronAmXMLProcessor` class to extract clippings from JP2 images.
+    """Uses JSON files produced using the `ChronAmXMLProcessor` class with the default nested layout to extract clippings from JP2 images.
     
     Attributes:
-        files (list[str]) : a list of truncated filepaths for which both .json and .jp2 extensions are present.
+        files    (list[str])                 : a list of truncated filepaths for which both .json and .jp2 extensions are present.
+        executor (ThreadPoolExecutor | None) : an optional executor for cropping and saving clippings concurrently.
     """
 
-    def __init__(self, data_dir: str) -> None:
+    def __init__(self, data_dir: str, executor: Optional[ThreadPoolExecutor]=None) -> None:
         """Initializes a `ChronAmJP2Clipper` from a data directory by scanning for JP2 and corresponding JSON files."""
         self.files: list[str] = []
-        for root, _, files in walk(data_dir):
-            for file in files:
-                if file.endswith('jp2'):
-                    path_no_ext = path.splitext(path.join(root, file))[0]
-                    if not path.exists(path_no_ext + '.json'):
-                        print(f'WARNING: no corresponding JSON file found for JP2 file {path_no_ext}.jp2.')
-                        continue
-                    self.files.append(path_no_ext)
+        self.executor = executor
+
+        def scan(directory: str) -> None:
+            """Recursively scans `directory`, appending paths with both .jp2 and .json files to `self.files`."""
+            subdirs, jp2_stems, json_stems = [], [], set()
+            with scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    else:
+                        stem, ext = path.splitext(entry.name)
+                        if ext == '.jp2':
+                            jp2_stems.append(stem)
+                        elif ext == '.json':
+                            json_stems.add(stem)
+
+            for stem in jp2_stems:
+                path_no_ext = path.join(directory, stem)
+                if stem not in json_stems:
+                    logger.warning('no corresponding JSON file found for JP2 file %s.jp2.', path_no_ext)
+                    continue
+                self.files.append(path_no_ext)
+
+            for subdir in subdirs:
+                scan(subdir)
+
+        scan(data_dir)
     
     @staticmethod
-    def get_box(dic: dict, ratio_w: float, ratio_h: float) -> tuple[int, int, int, int]:
+    def get_box(dic: dict, ratio_w: float, ratio_h: float) -> tuple[float, float, float, float]:
         """Takes a dictionary from a JSON file generated using a `ChronAmXMLProcessor` and returns a bounding box for the corresponding JP2."""
         left, right = dic['left'] / ratio_w, dic['right'] / ratio_w
         upper, lower = dic['upper'] / ratio_h, dic['lower'] / ratio_h
         return left, upper, right, lower
 
-    def clip(self, filepath: str, level: str) -> tuple[int, str]:
+    def clip(self, filepath: str, level: str, compress_level: int=6) -> tuple[int, str]:
         """Clips PNG images from the specified JP2 file at the specified level. PNG images are stored in a 'clippings-<level>' subirectory in the same directory as the provided `filepath`.
         
         Arguments:
-            path  (str) : a path without a file extension; both .json and .jp2 extensions must be present.
-            level (str) : the level of granularity at which to clip; one of "block," "line," or "word".
+            path           (str) : a path without a file extension; both .json and .jp2 extensions must be present.
+            level          (str) : the level of granularity at which to clip; one of "block," "line," or "word".
+            compress_level (int) : the zlib compression level for PNG output, from 0 to 9; lower levels are faster but produce larger files.
 
         Returns:
             _ (tuple[int, str]) : a tuple containing the number of clippings saved and the directory they were saved to.
@@ -58,30 +83,29 @@ class ChronAmJP2Clipper:
         jp2_width, jp2_height = jp2.size
         ratio_w, ratio_h = page_dict['width'] / jp2_width, page_dict['height'] / jp2_height
 
-        clipped = 0
-        for block_id, block_dict in page_dict.items():
-            # skip the "height" and "width" entries
-            if type(block_dict) is float:
-                continue
-            if level == 'block': 
-                jp2.crop(ChronAmJP2Clipper.get_box(block_dict, ratio_w, ratio_h)).save(path.join(clippings_dir, f'{block_id}.png'))
-                clipped += 1
+        # gather every bounding box first so that the decoded image is only touched by the crop loop below,
+        # keeping only dict entries, i.e. child elements, at each level
+        entries = [(block_id, block_dict) for block_id, block_dict in page_dict.items() if isinstance(block_dict, dict)]
+        if level != 'block':
+            entries = [(line_id, line_dict) for _, block_dict in entries for line_id, line_dict in block_dict.items() if isinstance(line_dict, dict)]
+        if level == 'word':
+            entries = [(string_id, string_dict) for _, line_dict in entries for string_id, string_dict in line_dict.items() if isinstance(string_dict, dict)]
+        boxes = [(clipping_id, ChronAmJP2Clipper.get_box(dic, ratio_w, ratio_h)) for clipping_id, dic in entries]
 
-            else:
-                for line_id, line_dict in block_dict.items():
-                    if type(line_dict) is float:
-                        continue
-                    if level == 'line':
-                        jp2.crop(ChronAmJP2Clipper.get_box(line_dict, ratio_w, ratio_h)).save(path.join(clippings_dir, f'{line_id}.png'))
-                        clipped += 1
-                    
-                    else:
-                        for string_id, string_dict in line_dict.items():
-                            if type(line_dict) is float:
-                                continue
-                            jp2.crop(ChronAmJP2Clipper.get_box(string_dict, ratio_w, ratio_h)).save(path.join(clippings_dir, f'{string_id}.png'))
-                            clipped += 1
+        def save_clipping(clipping_id: str, box: tuple[float, float, float, float]) -> None:
+            """Crops `box` from the decoded JP2 and saves it as a PNG named after `clipping_id`."""
+            jp2.crop(box).save(path.join(clippings_dir, f'{clipping_id}.png'), compress_level=compress_level)
+
+        # decode the JP2 once up front so that concurrent crops all read from the same decoded image
+        jp2.load()
+        if self.executor:
+            for worker in as_completed([self.executor.submit(save_clipping, *clipping) for clipping in boxes]):
+                worker.result()
+        else:
+            for clipping in boxes:
+                save_clipping(*clipping)
+        clipped = len(boxes)
         
-        print(f'INFO: saved {clipped} clippings to {clippings_dir}.')
+        logger.info('saved %d clippings to %s.', clipped, clippings_dir)
         return clipped, clippings_dir
 
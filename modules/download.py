@@ -1,9 +1,13 @@
-from typing import ClassVar, Optional
-from os import path
-from pathlib import Path
+from typing import ClassVar, Iterable, Optional
+from logging import getLogger
+from os import path, makedirs, scandir
+from shutil import copyfileobj
 from modules.limit import ChronAmRateLimiter
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
 import requests
+from modules.session import make_session
+
+logger = getLogger(__name__)
 
 class ChronAmDownloader:
     """Downloads and tracks progress for downloading XML, TXT, PDF, and JP2 files from [Chronicling America](https://chroniclingamerica.loc.gov/about/).
@@ -17,19 +21,27 @@ class ChronAmDownloader:
             an object storing timestamps to prevent rate limiting from the API.
         executor (ThreadPoolExecutor | None): 
             an optional executor for executing downloads concurrently.
+        max_workers (int):
+            the number of workers in `executor`, which sizes the connection pool of `session` and bounds the number of pending downloads.
+        session (requests.Session):
+            a session shared by all downloads so that connections to loc.gov are kept alive and reused.
     """
 
     DATA_URL: ClassVar[str] = 'https://chroniclingamerica.loc.gov/lccn/'
     FILETYPES: ClassVar[list[str]] = ['xml', 'txt', 'pdf', 'jp2']
+    TIMEOUT: ClassVar[tuple[float, float]] = (5, 30)
+    CHUNK_SIZE: ClassVar[int] = 1024 * 1024
+    DEFAULT_WORKERS: ClassVar[int] = 4
 
-    def __init__(self, id_list: list[str], data_dir: str, limiter: ChronAmRateLimiter, executor: Optional[ThreadPoolExecutor]=None) -> None:
+    def __init__(self, id_list: list[str], data_dir: str, limiter: ChronAmRateLimiter, executor: Optional[ThreadPoolExecutor]=None, max_workers: Optional[int]=None) -> None:
         """Initializes the object and validates attributes where applicable. Raises ValueError if attributes cannot be validated or fixed.
         
         Arguments:
-            id_list  (list[str])                 : a list of IDs to be downloaded; IDs have the format `<lccn>/<YYYY>-<MM>-<DD>/ed-<edition_no>/seq-<page_no>/`
-            data_dir (str)                       : a directory to write the downloaded files to
-            limiter  (ChronAmRateLimiter)        : an object storing timestamps to prevent rate limiting from the API.
-            executor (ThreadPoolExecutor | None) : an optional executor for executing downloads concurrently.
+            id_list     (list[str])                 : a list of IDs to be downloaded; IDs have the format `<lccn>/<YYYY>-<MM>-<DD>/ed-<edition_no>/seq-<page_no>/`
+            data_dir    (str)                       : a directory to write the downloaded files to
+            limiter     (ChronAmRateLimiter)        : an object storing timestamps to prevent rate limiting from the API.
+            executor    (ThreadPoolExecutor | None) : an optional executor for executing downloads concurrently.
+            max_workers (int | None)                : the number of workers in `executor`; defaults to `DEFAULT_WORKERS` if `executor` is provided and 1 otherwise.
 
         """
 
@@ -38,19 +50,29 @@ class ChronAmDownloader:
         if not path.isdir(data_dir):
             raise FileNotFoundError(f'ERROR: provided data directory {data_dir} is not a directory.')
         self.data_dir = data_dir
+        self._data_dir_sep = path.join(data_dir, '')
+        self._known_dirs: set[str] = set()
+
+        # parse each ID into its directory and extensionless file path once, rather than on every download and check
+        self._prefixes: dict[str, tuple[str, str]] = {id: self._parse_id(id) for id in self.ids}
 
         self.limiter = limiter
         self.executor = executor
+        if max_workers is None:
+            max_workers = ChronAmDownloader.DEFAULT_WORKERS if executor else 1
+        self.max_workers = max_workers
+        self.session = make_session(max_workers)
     
     @staticmethod
-    def from_file(filepath: str, data_dir: str, limiter: ChronAmRateLimiter, executor: Optional[ThreadPoolExecutor]=None, sep: str='\n') -> 'ChronAmDownloader':
+    def from_file(filepath: str, data_dir: str, limiter: ChronAmRateLimiter, executor: Optional[ThreadPoolExecutor]=None, sep: str='\n', max_workers: Optional[int]=None) -> 'ChronAmDownloader':
         """Initializes a `ChronAmDownloader` object from a file of newline-separated IDs.
         
         Arguments:
-            filepath (str)                       : the path to the file containing IDs.
-            limiter  (ChronAmRateLimiter)        : an object storing timestamps to prevent rate limiting from the API.
-            executor (ThreadPoolExecutor | None) : an optional executor for executing downloads concurrently.
-            sep      (str)                       : the separator between IDs in the file, newline by default.
+            filepath    (str)                       : the path to the file containing IDs.
+            limiter     (ChronAmRateLimiter)        : an object storing timestamps to prevent rate limiting from the API.
+            executor    (ThreadPoolExecutor | None) : an optional executor for executing downloads concurrently.
+            sep         (str)                       : the separator between IDs in the file, newline by default.
+            max_workers (int | None)                : the number of workers in `executor`; see `__init__`.
 
         Returns:
             _ (ChronAmDownloader) : a `ChronAmDownloader` initialized with the IDs in read from the file at `filepath`.
@@ -60,7 +82,7 @@ class ChronAmDownloader:
         with open(filepath, 'r') as fp:
             id_list = fp.read().strip().split(sep)
 
-        return ChronAmDownloader([id for id in id_list if id], data_dir, limiter, executor)
+        return ChronAmDownloader([id for id in id_list if id], data_dir, limiter, executor, max_workers)
 
     @staticmethod
     def id_to_url(id: str, filetype: str) -> str:
@@ -73,9 +95,14 @@ class ChronAmDownloader:
         else:
             raise ValueError('ERROR: filetype must be one of ("xml", "txt", "pdf", "jp2")')
     
+    def _parse_id(self, id: str) -> tuple[str, str]:
+        """Returns the directory and the extensionless file path associated with the provided ID."""
+        # IDs are always relative, so plain concatenation gives the same result as `path.join` without its checks
+        return self._data_dir_sep + id.split('seq')[0], self._data_dir_sep + id[:-1]
+
     def id_to_path(self, id: str, filetype: str) -> str:
         """Returns the path to the file associated with the provided ID and filetype."""
-        return f'{path.join(self.data_dir, id[:-1])}.{filetype}'
+        return f'{(self._prefixes.get(id) or self._parse_id(id))[1]}.{filetype}'
     
     @property
     def paths(self) -> list[str]:
@@ -85,14 +112,26 @@ class ChronAmDownloader:
     def check_downloads(self, filetype: str) -> None:
         """Checks whether files of type `filetype` have been downloaded and updates `self.ids` accordingly."""
 
+        # list each directory once instead of checking every file individually
+        listings: dict[str, set[str]] = {}
+
         exists = 0
         for id, types in self.ids.items():
-            types.clear()
-            if path.exists(f'{path.join(self.data_dir, id[:-1])}.{filetype}'):
+            id_dir, filename = path.split(self.id_to_path(id, filetype))
+            if id_dir not in listings:
+                try:
+                    with scandir(id_dir) as entries:
+                        listings[id_dir] = {entry.name for entry in entries}
+                except FileNotFoundError:
+                    listings[id_dir] = set()
+
+            if filename in listings[id_dir]:
                 types.add(filetype)
                 exists += 1
+            else:
+                types.discard(filetype)
         
-        print(f'INFO: {exists} files of type "{filetype}" already present; {len(self.ids) - exists} not found.')
+        logger.info('%d files of type "%s" already present; %d not found.', exists, filetype, len(self.ids) - exists)
 
     def download_file(self, id: str, filetype: str) -> str:
         """Downloads an XML, TXT, PDF, or JP2 file for the provided ID to `self.data_dir/<lccn>/<YYYY>-<MM>-<DD>/ed-<edition_no>/seq-<page_no>.<filetype>`.
@@ -114,13 +153,21 @@ class ChronAmDownloader:
             raise ValueError('ERROR: filetype must be one of ("xml", "txt", "pdf", "jp2").')
         
         url = ChronAmDownloader.id_to_url(id, filetype)
-        Path(path.join(self.data_dir, id.split('seq')[0])).mkdir(parents=True, exist_ok=True)
+
+        # makedirs is idempotent, so a race between threads on the same directory only costs a redundant call
+        id_dir = (self._prefixes.get(id) or self._parse_id(id))[0]
+        if id_dir not in self._known_dirs:
+            makedirs(id_dir, exist_ok=True)
+            self._known_dirs.add(id_dir)
+
         try:
-            with self.limiter.submit(requests.get, url) as response:
+            with self.limiter.submit(self.session.get, url, stream=True, timeout=ChronAmDownloader.TIMEOUT) as response:
                 response.raise_for_status()
+
+                # loc.gov may gzip text responses, so the raw stream still needs to be decoded
+                response.raw.decode_content = True
                 with open(self.id_to_path(id, filetype), 'wb') as file:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        file.write(chunk)
+                    copyfileobj(response.raw, file, ChronAmDownloader.CHUNK_SIZE)
 
         except requests.exceptions.HTTPError:
             raise requests.exceptions.HTTPError(f'ERROR: download for {url} failed with code {response.status_code}.')
@@ -155,7 +202,7 @@ class ChronAmDownloader:
                     self.download_file(id, filetype)
                     return True
                 except Exception as e:
-                    print(f'ERROR: download for id {id} failed; {n_retries - i - 1} attempts remaining.')
+                    logger.error('download for id %s failed; %d attempts remaining.', id, n_retries - i - 1)
                     exception = e
             
             if allow_fail:
@@ -166,8 +213,21 @@ class ChronAmDownloader:
         self.check_downloads(filetype)
 
         downloaded, failed, skipped = 0, 0, 0
-        if self.executor:
-            workers = []
+
+        # maps pending futures to their IDs; at most `max_pending` futures are held at once
+        workers: dict[Future[bool], str] = {}
+        max_pending = 2 * self.max_workers
+
+        def collect(done: Iterable[Future[bool]]) -> None:
+            """Tallies the results of completed futures and removes them from `workers`."""
+            nonlocal downloaded, failed
+            for worker in done:
+                id = workers.pop(worker)
+                if worker.result():
+                    downloaded += 1
+                else:
+                    logger.warning('skipping id %s after failed download.', id)
+                    failed += 1
 
         for id, types in self.ids.items():
 
@@ -176,14 +236,15 @@ class ChronAmDownloader:
                 continue
 
             if self.executor:
-                workers.append(self.executor.submit(download_file_with_retry, id, filetype))
+                if len(workers) >= max_pending:
+                    collect(wait(workers, return_when=FIRST_COMPLETED).done)
+                workers[self.executor.submit(download_file_with_retry, id, filetype)] = id
+            elif download_file_with_retry(id, filetype):
+                downloaded += 1
             else:
-                downloaded += bool(download_file_with_retry(id, filetype))
-        
-        if self.executor:
-            downloaded = sum(worker.result() for worker in as_completed(workers))
+                failed += 1
         
-        failed = len(self.ids) - downloaded - skipped
+        collect(as_completed(list(workers)))
         
-        print(f'INFO: {downloaded} downloaded, {failed} failed, {skipped} skipped.')
+        logger.info('%d downloaded, %d failed, %d skipped.', downloaded, failed, skipped)
         return downloaded, failed, skipped
@@ -0,0 +1,48 @@
+from os import chmod, close, path, remove, replace, umask
+from json import dump
+from tempfile import mkstemp
+from typing import Any, Optional
+
+# orjson is an optional, faster drop-in for decoding API responses and encoding results
+try:
+    from orjson import loads, dumps, OPT_NON_STR_KEYS
+
+    def write_json(obj: Any, filepath: str, indent: Optional[int] = None) -> None:
+        """Writes `obj` to `filepath` as JSON, indented by `indent` spaces if provided and compact otherwise."""
+        # orjson only supports two-space indentation, so other indents fall back to the standard library
+        if indent is not None:
+            with open(filepath, 'w') as fp:
+                dump(obj, fp, indent=indent)
+        else:
+            with open(filepath, 'wb') as fp:
+                fp.write(dumps(obj, option=OPT_NON_STR_KEYS))
+except ImportError:
+    from json import loads
+
+    def write_json(obj: Any, filepath: str, indent: Optional[int] = None) -> None:
+        """Writes `obj` to `filepath` as JSON, indented by `indent` spaces if provided and compact otherwise."""
+        with open(filepath, 'w') as fp:
+            dump(obj, fp, indent=indent, separators=None if indent is not None else (',', ':'))
+
+# `umask` can only be read by setting it, so it is read once here rather than on every write
+_UMASK = umask(0)
+umask(_UMASK)
+
+def dump_atomic(obj: Any, filepath: str) -> None:
+    """Writes `obj` as compact JSON to `filepath` through a temporary file in the same directory, so that concurrent readers never see a partial file.
+
+    The file gets the same permissions as one created with `open`, and the temporary file is removed if writing fails.
+    """
+    fd, tmp_path = mkstemp(dir=path.dirname(filepath) or '.', suffix='.tmp')
+    close(fd)
+    try:
+        write_json(obj, tmp_path)
+        # `mkstemp` creates files readable only by their owner
+        chmod(tmp_path, 0o666 & ~_UMASK)
+        replace(tmp_path, filepath)
+    except BaseException:
+        try:
+            remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
@@ -1,62 +1,59 @@
-from time import time, sleep
-from threading import RLock
+from time import monotonic
+from logging import getLogger
+from threading import Condition, Lock
+from collections import deque
 from typing import Callable, TypeVar
 
+logger = getLogger(__name__)
+
 _R = TypeVar('_R')
 
 class ChronAmRateLimiter:
     """This object keeps track of rate limits for the [loc.gov newspaper API](https://libraryofcongress.github.io/data-exploration/loc.gov%20JSON%20API/Chronicling_America/README.html#rate-limits).
 
     Attributes:
-        burst_times (list[float])        : a list of request timestamps, oldest first; ensures compliance with burst limit.
-        crawl_times (list[float])        : a list of request timestamps, oldest first; ensures compliance with crawl limit.
-        lock        (RLock)              : provisions access to `burst_times` and `crawl_times`.
+        burst_times (deque[float])       : the timestamps of the last `BURST_MAX` requests, oldest first; ensures compliance with burst limit.
+        crawl_times (deque[float])       : the timestamps of the last `CRAWL_MAX` requests, oldest first; ensures compliance with crawl limit.
+        lock        (Condition)          : provisions access to `burst_times` and `crawl_times`; waiting threads sleep on it until the limit allows another request.
     """
 
     BURST_WINDOW, BURST_MAX = 60, 20
     CRAWL_WINDOW, CRAWL_MAX = 10, 20
 
+    __slots__ = ('burst_times', 'crawl_times', 'lock')
+
     def __init__(self):
-        self.burst_times: list[float] = []
-        self.crawl_times: list[float] = []
-        self.lock = RLock()
-    
-    def _clean_timestamps(self):
-        """Removes timestamps from `self.burst_lock` and `self.crawl_lock` that are outside the respective windows."""
-        now = time()
-        self.burst_times = [t for t in self.burst_times if now - t < ChronAmRateLimiter.BURST_WINDOW]
-        self.crawl_times = [t for t in self.crawl_times if now - t < ChronAmRateLimiter.CRAWL_WINDOW]
-
-    def _record_request(self):
-        """Records timestamp when request is made."""
-        now = time()
+        # bounded queues drop the oldest timestamp on append, so each holds at most one window's worth of requests
+        self.burst_times: deque[float] = deque(maxlen=ChronAmRateLimiter.BURST_MAX)
+        self.crawl_times: deque[float] = deque(maxlen=ChronAmRateLimiter.CRAWL_MAX)
+        self.lock = Condition(Lock())
+
+    def _record_request(self, now: float):
+        """Records timestamp `now` when request is made."""
         self.burst_times.append(now)
         self.crawl_times.append(now)
 
-    def _check_wait(self) -> float:
-        """Checks whether limits are exceeded and returns the time to wait."""
-        self._clean_timestamps()
+    def _check_wait(self, now: float) -> float:
+        """Checks whether limits are exceeded as of `now` and returns the time to wait."""
         burst_wait, crawl_wait = float(0), float(0)
- 
-        if len(self.burst_times) > ChronAmRateLimiter.BURST_MAX:
-            burst_wait = max(0, self.burst_times[0] + ChronAmRateLimiter.BURST_WINDOW - time())
 
-        if len(self.crawl_times) > ChronAmRateLimiter.CRAWL_MAX:
-             crawl_wait = max(0, self.crawl_times[0] + ChronAmRateLimiter.CRAWL_WINDOW - time())
+        # a window is only full if the oldest of its last `MAX` requests is still inside it
+        if len(self.burst_times) == self.burst_times.maxlen:
+            burst_wait = max(0, self.burst_times[0] + ChronAmRateLimiter.BURST_WINDOW - now)
+
+        if len(self.crawl_times) == self.crawl_times.maxlen:
+            crawl_wait = max(0, self.crawl_times[0] + ChronAmRateLimiter.CRAWL_WINDOW - now)
         
         return max(burst_wait, crawl_wait)
 
     def submit(self, f: Callable[..., _R], *args, **kwargs) -> _R:
         """Runs f(*args, **kwargs) as soon as possible without exceeding the rate limit."""
 
-        wait = 0
         with self.lock:
-            if not (wait := self._check_wait()):
-                self._record_request()
-        
-        if wait:
-            print(f'INFO: rate limit reached; waiting {wait:.2f} seconds.')
-            sleep(wait)
-            return self.submit(f, *args, **kwargs)
-        else:
-            return f(*args, **kwargs)
+            # waiting on the condition releases the lock, so other threads can check in the meantime
+            while (wait := self._check_wait(now := monotonic())):
+                logger.info('rate limit reached; waiting %.2f seconds.', wait)
+                self.lock.wait(wait)
+            self._record_request(now)
+
+        return f(*args, **kwargs)
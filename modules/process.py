@@ -1,7 +1,35 @@
-from os import walk, path
-from json import dump
+from os import scandir, path
+from logging import getLogger
+from functools import partial
+from typing import ClassVar, Optional, Union
+from concurrent.futures import Executor, ThreadPoolExecutor
+
 from xml.etree import ElementTree as ET
 
+# lxml is opt-in through `use_lxml`; it is no faster than the standard library for this streaming loop, but lets each element be detached
+# from its parent once read rather than only cleared
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
+# orjson is an optional, faster drop-in for encoding JSON output
+try:
+    from orjson import dumps, OPT_INDENT_2
+
+    def _encode_json(obj: dict, pretty: bool) -> bytes:
+        return dumps(obj, option=OPT_INDENT_2 if pretty else 0)
+except ImportError:
+    from json import dumps
+
+    def _encode_json(obj: dict, pretty: bool) -> bytes:
+        return (dumps(obj, indent=2) if pretty else dumps(obj, separators=(',', ':'))).encode()
+
+logger = getLogger(__name__)
+
+# qualified (Page, PrintSpace, TextBlock, TextLine, String) tags for each ALTO namespace seen, shared across files
+_TAG_CACHE: dict[str, tuple[str, str, str, str, str]] = {}
+
 class ChronAmXMLProcessor:
     """Processes Chronicling America XML files into JSON files containing text and bounding box information.
     
@@ -9,78 +37,269 @@ class ChronAmXMLProcessor:
         files (list[str]) : a list of filepaths
     """
 
+    LAYOUTS: ClassVar[tuple[str, ...]] = ('nested', 'columnar')
+    BOX_KEYS: ClassVar[tuple[str, ...]] = ('left', 'upper', 'right', 'lower')
+    # the columns of each table in the columnar layout, before any bounding box columns
+    COLUMNS: ClassVar[dict[str, tuple[str, ...]]] = {
+        'blocks':  ('id',),
+        'lines':   ('id', 'block_id', 'hyphen'),
+        'strings': ('id', 'block_id', 'line_id', 'content'),
+    }
+
     def __init__(self, data_dir: str) -> None:
         """Initializes a `ChronAmXMLProcessor` from a data directory by scanning for XML files."""
-        self.files = []
-        for root, _, files in walk(data_dir):
-            for file in files:
-                if file.endswith('xml'):
-                    self.files.append(path.join(root, file))
+        self.files: list[str] = []
+
+        def scan(directory: str) -> None:
+            """Recursively scans `directory`, appending the paths of XML files to `self.files`."""
+            subdirs = []
+            with scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.name.endswith('.xml'):
+                        self.files.append(entry.path)
+
+            for subdir in subdirs:
+                scan(subdir)
+
+        scan(data_dir)
+
+        logger.info('found %d XML files in directory %s', len(self.files), data_dir)
+
+    @staticmethod
+    def _new_tables(include_bounding_box: bool) -> tuple[dict[str, list], dict[str, list], dict[str, list]]:
+        """Utility function returning empty `blocks`, `lines`, and `strings` tables with the columns given by `COLUMNS` and, optionally, `BOX_KEYS`."""
+        box_keys = ChronAmXMLProcessor.BOX_KEYS if include_bounding_box else ()
+        return tuple({key: [] for key in (*columns, *box_keys)} for columns in ChronAmXMLProcessor.COLUMNS.values())
+
+    @staticmethod
+    def to_columnar(page_dict: dict) -> dict:
+        """Converts a nested page dictionary, as written by `process_xml` with `layout='nested'`, into a columnar one.
+
+        `process_xml` builds this layout directly when called with `layout='columnar'`; this converts JSON that has already been written.
+
+        The columnar layout has a `blocks`, `lines`, and `strings` table, each mapping a column name to a list with one entry per element:
+        `id` for every table, `block_id` for lines and strings, `line_id` and `content` for strings, and `hyphen` for lines.
+        If the page includes bounding box data, every table also has `left`, `upper`, `right`, and `lower` columns and the page keeps its `height` and `width`.
+        """
+        has_box = 'height' in page_dict
+        box_keys = ChronAmXMLProcessor.BOX_KEYS if has_box else ()
+
+        blocks, lines, strings = ChronAmXMLProcessor._new_tables(has_box)
+        columnar = {'height': page_dict['height'], 'width': page_dict['width']} if has_box else {}
+        columnar.update(blocks=blocks, lines=lines, strings=strings)
+
+        # non-dict entries are bounding box coordinates, page dimensions, or hyphenation flags rather than children
+        for block_id, block_dict in page_dict.items():
+            if not isinstance(block_dict, dict):
+                continue
+            blocks['id'].append(block_id)
+            for key in box_keys: blocks[key].append(block_dict[key])
+
+            for line_id, line_dict in block_dict.items():
+                if not isinstance(line_dict, dict):
+                    continue
+                lines['id'].append(line_id)
+                lines['block_id'].append(block_id)
+                lines['hyphen'].append(line_dict.get('HYPHEN', False))
+                for key in box_keys: lines[key].append(line_dict[key])
+
+                for string_id, string_dict in line_dict.items():
+                    if not isinstance(string_dict, dict):
+                        continue
+                    strings['id'].append(string_id)
+                    strings['block_id'].append(block_id)
+                    strings['line_id'].append(line_id)
+                    strings['content'].append(string_dict['content'])
+                    for key in box_keys: strings[key].append(string_dict[key])
+
+        return columnar
 
-        print(f'INFO: found {len(self.files)} XML files in directory {data_dir}')
-    
     @staticmethod
-    def process_xml(filepath: str, include_bounding_box=False, overwrite=False) -> str:
+    def process_xml(filepath: str, include_bounding_box=False, overwrite=False, pretty=False, layout='nested', write=True, use_lxml=False) -> Union[str, tuple[str, Optional[bytes]]]:
         """Processes the XML file at `filepath` into a JSON file in the same directory.
         
         Arguments:
             filepath             (str)  : the file to process; output will be written to a JSON file in the same directory.
             include_bounding_box (bool) : whether to include bounding box data in JSON output; default False.
-            overwrite            (bool) : whether to overwrite existing XML; default False.
+            overwrite            (bool) : whether to overwrite existing JSON; default False, in which case JSON is only rewritten if the XML file is newer.
+                                          The existing JSON's layout and bounding box data aren't checked, so pass True when changing `layout` or `include_bounding_box`.
+            pretty               (bool) : whether to indent the JSON output for readability; default False, which writes compact JSON.
+            layout               (str)  : `'nested'` for a block -> line -> string mapping, or `'columnar'` for parallel lists (see `to_columnar`); default `'nested'`.
+            write                (bool) : whether to write the JSON file; default True. If False, the encoded JSON is returned instead of written.
+            use_lxml             (bool) : whether to parse with lxml instead of the standard library, detaching each element from the tree once read; default False.
         
         Returns:
-            _ (str) : the path to the JSON file.
+            _ (str)                        : the path to the JSON file, if `write` is True.
+            _ (tuple[str, Optional[bytes]]) : the path to the JSON file and its encoded contents, if `write` is False; the contents are `None` if the file is already up to date.
+
+        Raises:
+            ValueError  : if the XML file cannot be parsed or `layout` is not recognized.
+            ImportError : if `use_lxml` is True but lxml is not installed.
 
         """
 
+        if layout not in ChronAmXMLProcessor.LAYOUTS:
+            raise ValueError('argument layout must be one of "nested" or "columnar".')
+        if use_lxml and lxml_etree is None:
+            raise ImportError('ERROR: use_lxml=True requires lxml; install it with `pip install -r requirements-opt.txt`.')
+        etree = lxml_etree if use_lxml else ET
+
         json_path = path.join(path.dirname(filepath), path.basename(filepath).replace('xml', 'json'))
-        if path.exists(json_path) and not overwrite:
-            return json_path
+        # skip parsing entirely when the existing JSON is at least as new as its source, whatever layout it was written with
+        if not overwrite and path.exists(json_path) and path.getmtime(filepath) <= path.getmtime(json_path):
+            return json_path if write else (json_path, None)
 
         def add_bounding_box(root: ET.Element, dic: dict) -> None:
             """Utility function for reading bounding box data from `root` into `dic`."""
-            left,  upper = float(root.attrib['HPOS']), float(root.attrib['VPOS'])
-            right, lower = left + float(root.attrib["WIDTH"]), upper + float(root.attrib['HEIGHT'])
-            dic['left'], dic['upper'], dic['right'], dic['lower'] = left, upper, right, lower
+            attrib = root.attrib
+            left, upper, width, height = map(float, (attrib['HPOS'], attrib['VPOS'], attrib['WIDTH'], attrib['HEIGHT']))
+            dic.update(left=left, upper=upper, right=left + width, lower=upper + height)
+
+        def append_bounding_box(root: ET.Element, table: dict) -> None:
+            """Utility function for appending bounding box data from `root` to the columns of `table`."""
+            attrib = root.attrib
+            left, upper, width, height = map(float, (attrib['HPOS'], attrib['VPOS'], attrib['WIDTH'], attrib['HEIGHT']))
+            table['left'].append(left)
+            table['upper'].append(upper)
+            table['right'].append(left + width)
+            table['lower'].append(upper + height)
 
         if not filepath.endswith('xml'):
-            print(f'WARNING: file {filepath} must be an XML file.')
-        
-        root = ET.parse(filepath).getroot() or ET.Element('')
-        schema = root[0].tag.split('}')[0] + '}'
-        
-        if root.tag == '':
-            raise ValueError(f'Failed to parse XML file at {filepath}')
+            logger.warning('file %s must be an XML file.', filepath)
         
         page_dict = {}
+        schema, in_print_space = '', False
+        block_id, line_id, subs_type = None, None, ''
+        block_dict, line_dict = None, None
+
+        # for the columnar layout, rows are appended to these tables as each element is read rather than built as nested dictionaries
+        columnar = layout == 'columnar'
+        if columnar:
+            blocks, lines, strings = ChronAmXMLProcessor._new_tables(include_bounding_box)
+
+        # the number of open elements inside the PrintSpace; as with `findall`, only TextBlocks directly under the PrintSpace,
+        # TextLines directly under those, and Strings directly under those are read, so e.g. TextBlocks inside a ComposedBlock are skipped
+        depth = 0
+
+        # stream the file in a single pass, dispatching on each element's tag; each child of the PrintSpace is discarded once it has been read
+        # and parsing stops at the end of the PrintSpace
+        try:
+            for event, elem in etree.iterparse(filepath, events=('start', 'end')):
+                if not schema:
+                    # the first event is the start of the root element, which carries the ALTO namespace
+                    ns = elem.tag[1:].partition('}')[0] if elem.tag.startswith('{') else ''
+                    schema = f'{{{ns}}}'
+                    tags = _TAG_CACHE.get(ns)
+                    if tags is None:
+                        tags = _TAG_CACHE.setdefault(ns, tuple(f'{schema}{tag}' if ns else tag for tag in ('Page', 'PrintSpace', 'TextBlock', 'TextLine', 'String')))
+                    page_tag, ps_tag, tb_tag, tl_tag, s_tag = tags
+                    continue
+
+                tag = elem.tag
+                if event == 'start':
+                    if in_print_space:
+                        if tag == s_tag and depth == 2 and line_id is not None:
+                            attrib = elem.attrib
+                            subs_type = attrib.get('SUBS_TYPE', '')
+                            if columnar:
+                                strings['id'].append(attrib['ID'])
+                                strings['block_id'].append(block_id)
+                                strings['line_id'].append(line_id)
+                                strings['content'].append(attrib['CONTENT'])
+                                if include_bounding_box: append_bounding_box(elem, strings)
+                            else:
+                                string_dict = {'content': attrib['CONTENT']}
+                                if include_bounding_box: add_bounding_box(elem, string_dict)
+                                line_dict[attrib['ID']] = string_dict
+                        elif tag == tl_tag and depth == 1 and block_id is not None:
+                            line_id, subs_type = elem.attrib['ID'], ''
+                            if columnar:
+                                lines['id'].append(line_id)
+                                lines['block_id'].append(block_id)
+                                if include_bounding_box: append_bounding_box(elem, lines)
+                            else:
+                                line_dict = {}
+                                if include_bounding_box: add_bounding_box(elem, line_dict)
+                        elif tag == tb_tag and depth == 0:
+                            block_id = elem.attrib['ID']
+                            if columnar:
+                                blocks['id'].append(block_id)
+                                if include_bounding_box: append_bounding_box(elem, blocks)
+                            else:
+                                block_dict = {}
+                                if include_bounding_box: add_bounding_box(elem, block_dict)
+                        depth += 1
+                    elif tag == page_tag and include_bounding_box:
+                        page_dict['height'] = float(elem.attrib['HEIGHT'])
+                        page_dict['width']  = float(elem.attrib['WIDTH'])
+                    elif tag == ps_tag:
+                        in_print_space = True
 
-        for subtag in ('Layout', 'Page'):
-            root = root.find(f'{schema}{subtag}') or ET.Element('')
-        if include_bounding_box:
-            page_dict['height'] = float(root.attrib['HEIGHT'])
-            page_dict['width']  = float(root.attrib['WIDTH'])
-
-        root = root.find(f'{schema}PrintSpace') or ET.Element('')
-        for block in root.findall(f'{schema}TextBlock'):
-            block_dict = {}
-            if include_bounding_box: add_bounding_box(block, block_dict)
-            for line in block.findall(f'{schema}TextLine'):
-                line_dict = {}
-                if include_bounding_box: add_bounding_box(line, line_dict)
-                for string in line.findall(f'{schema}String'):
-                    string_dict = {'content': string.attrib['CONTENT']}
-                    if include_bounding_box: add_bounding_box(string, string_dict)
-                    line_dict[string.attrib['ID']] = string_dict
-                if string.attrib.get('SUBS_TYPE', '') == 'HypPart1':
-                    line_dict['HYPHEN'] = True
-                block_dict[line.attrib['ID']] = line_dict
-            page_dict[block.attrib['ID']] = block_dict
+                elif in_print_space:
+                    if tag == ps_tag and depth == 0:
+                        # Chronicling America pages have a single PrintSpace, so nothing after it needs to be read
+                        break
+                    depth -= 1
+
+                    if tag == tl_tag and depth == 1 and line_id is not None:
+                        # hyphenation is marked on the last String of this line; lines without strings are never hyphenated
+                        hyphen = subs_type == 'HypPart1'
+                        if columnar:
+                            lines['hyphen'].append(hyphen)
+                        else:
+                            if hyphen: line_dict['HYPHEN'] = True
+                            block_dict[line_id] = line_dict
+                        line_id, line_dict = None, None
+
+                    elif depth == 0:
+                        if tag == tb_tag and block_id is not None:
+                            if not columnar: page_dict[block_id] = block_dict
+                            block_id, block_dict = None, None
+                        elem.clear()
+                        if use_lxml:
+                            while elem.getprevious() is not None:
+                                del elem.getparent()[0]
+        except etree.ParseError:
+            raise ValueError(f'Failed to parse XML file at {filepath}')
         
-        with open(json_path, 'w') as fp:
-            dump(page_dict, fp, indent=4)
+        if columnar:
+            page_dict.update(blocks=blocks, lines=lines, strings=strings)
 
+        data = _encode_json(page_dict, pretty)
+        if not write:
+            return json_path, data
+
+        ChronAmXMLProcessor._write_bytes(json_path, data)
         return json_path
+
+    @staticmethod
+    def _write_bytes(json_path: str, data: bytes) -> None:
+        """Utility function for writing encoded JSON returned by `process_xml` to `json_path`."""
+        with open(json_path, 'wb') as fp:
+            fp.write(data)
     
-    def process_all(self, include_bounding_box=False, overwrite=False) -> list[str]:
-        """Processes all of the XML files in `self.files` into JSON files using `process_xml`; returns a list of the files written."""
-        return [ChronAmXMLProcessor.process_xml(filepath, include_bounding_box, overwrite) for filepath in self.files]
+    def process_all(self, include_bounding_box=False, overwrite=False, executor: Optional[Executor]=None, pretty=False, layout='nested', use_lxml=False) -> list[str]:
+        """Processes all of the XML files in `self.files` into JSON files using `process_xml`; returns a list of the files written.
+
+        Parsing is CPU-bound, so pass a `ProcessPoolExecutor` as `executor` to process files in parallel across cores.
+        Workers then only parse and encode, while a small pool of writer threads writes their output so that slow storage doesn't stall parsing.
+        """
+        if not executor:
+            process = partial(ChronAmXMLProcessor.process_xml, include_bounding_box=include_bounding_box, overwrite=overwrite, pretty=pretty, layout=layout, use_lxml=use_lxml)
+            return [process(filepath) for filepath in self.files]
+
+        process = partial(ChronAmXMLProcessor.process_xml, include_bounding_box=include_bounding_box, overwrite=overwrite, pretty=pretty, layout=layout, write=False, use_lxml=use_lxml)
+        json_paths, writes = [], []
+        with ThreadPoolExecutor(max_workers=4) as writer:
+            for json_path, data in executor.map(process, self.files, chunksize=16):
+                json_paths.append(json_path)
+                if data is not None:
+                    writes.append(writer.submit(ChronAmXMLProcessor._write_bytes, json_path, data))
+
+        # surface any write errors
+        for future in writes:
+            future.result()
+
+        return json_paths
@@ -1,13 +1,45 @@
 from modules.limit import ChronAmRateLimiter
+from modules.cache import ChronAmPageCache
+from modules.jsonio import loads, write_json, dump_atomic
 from typing import Any, Optional, ClassVar
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from datetime import date, datetime, timedelta
-from urllib.parse import quote, quote_plus, unquote, unquote_plus
-from json import dump
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from datetime import date
+from urllib.parse import quote, quote_plus, unquote, urlsplit, parse_qs
+from json import load
+from os import path
+from time import time
+from hashlib import blake2b
+from itertools import chain
 import requests
+from modules.session import make_session
 from threading import Lock
+from logging import getLogger
+
+logger = getLogger(__name__)
 
 SEARCH_URL_BASE : str = 'https://chroniclingamerica.loc.gov/search/pages/results/?'
+SEARCH_URL_TAIL : str = '&format=json&searchType=advanced'
+
+# deletes hyphens from LCCNs in a single pass
+_LCCN_HYPHENS = str.maketrans('', '', '-')
+
+# URL date formats by `dateFilterType`, with the slashes of full dates already percent-encoded
+URL_DATE_FORMATS : dict[str, str] = {'yearRange': '%Y', 'range': '%m%%2F%d%%2F%Y'}
+SEARCH_TIMEOUT  : tuple[float, float] = (5, 30)
+
+# shared by queries that aren't given a session, so that paginated requests to loc.gov reuse kept-alive connections
+_session = make_session()
+
+def _quote_term(term: str) -> str:
+    """Percent-encodes a single search term, skipping `quote` for plain alphanumeric ASCII terms that it would leave unchanged."""
+    return term if term.isascii() and term.isalnum() else quote(term, safe='')
+
+def _parse_search_url(url: str) -> dict[str, str]:
+    """Returns the parameters of a Chronicling America search URL as a mapping of names to decoded values. Raises ValueError if the URL has no parameters."""
+    query_dict = {key: values[0] for key, values in parse_qs(urlsplit(url).query, keep_blank_values=True).items()}
+    if not query_dict:
+        raise ValueError("Failed to parse URL params.")
+    return query_dict
 
 class ChronAmQuery:
     """Stores parameters for a query to [Chronicling America Advanced Search](https://chroniclingamerica.loc.gov/#tab=tab_advanced_search);
@@ -30,7 +62,7 @@ class ChronAmQuery:
         proxdistance (int): 
             a nonnegative integer number of words representing the maximum distance allowed between members of `proxtext` (see `proxtext`).
         state (str): 
-            a U.S. state or territory; see the `STATES` class variable for a list of acceptable values.
+            a U.S. state or territory; see the `STATES_ORDERED` class variable for a list of acceptable values.
         lccn (str): 
             a Library of Congress Control Number (LCCN) for a publication indexed by Chronicling America; these can be found from the [Title Search API](https://chroniclingamerica.loc.gov/about/api/#search).
         dateFilterType (str): 
@@ -42,7 +74,7 @@ class ChronAmQuery:
         sequence (int): 
             the page of the issues to search, starting with `1` for the frontpage.
         language (str): 
-            one of a limited subset of ISO 639-2 (three-letter) language codes; see the `LANGS` class variable for a list of acceptable values.
+            one of a limited subset of ISO 639-2 (three-letter) language codes; see the `LANGS_ORDERED` class variable for a list of acceptable values.
         sort (str):
             determines ordering of search results; one of 'relevance', 'state', 'title', 'date'.
         
@@ -54,16 +86,27 @@ class ChronAmQuery:
             the results of the query, formatted as a mapping of indices (starting with 1) to newspaper page IDs.
         _results_lock (Lock):
             provisions access to `results`.
+        _url (str | None):
+            the cached value of `url`; reset to `None` whenever a query parameter is reassigned.
+        _retrieved_pages (set[tuple[int, int]]):
+            the `(page, page_size)` pairs that have been retrieved into `results`; cleared along with `results`.
 
         desc (str):
             a text description of the query
 
     """
 
-    STATES : ClassVar[list[str]] = ["", "Alabama","Alaska","Arizona","Arkansas","California","Colorado","Connecticut","Delaware","District of Columbia","Florida","Georgia","Hawaii","Idaho","Illinois","Indiana","Iowa","Kansas","Kentucky","Louisiana","Maine","Maryland","Massachusetts","Michigan","Minnesota","Mississippi","Missouri","Montana","Nebraska","Nevada","New Hampshire","New Jersey","New Mexico","New York","North Carolina","North Dakota","Ohio","Oklahoma","Oregon","Pennsylvania","Piedmont","Puerto Rico","Rhode Island","South Carolina","South Dakota","Tennessee","Texas","Utah","Vermont","Virgin Islands","Virginia","Washington","West Virginia","Wisconsin","Wyoming"]
-    LANGS  : ClassVar[list[str]] = ["", "ara","hrv","cze","dak","dan","eng","fin","fre","ger","ice","ita","lit","nob","pol","rum","slo","slv","spa","swe"]
-    SORTS  : ClassVar[list[str]] = ['relevance', 'state', 'title', 'data']
+    # the ordered tuples are kept for display; validation uses the frozensets
+    STATES_ORDERED : ClassVar[tuple[str, ...]] = ("", "Alabama","Alaska","Arizona","Arkansas","California","Colorado","Connecticut","Delaware","District of Columbia","Florida","Georgia","Hawaii","Idaho","Illinois","Indiana","Iowa","Kansas","Kentucky","Louisiana","Maine","Maryland","Massachusetts","Michigan","Minnesota","Mississippi","Missouri","Montana","Nebraska","Nevada","New Hampshire","New Jersey","New Mexico","New York","North Carolina","North Dakota","Ohio","Oklahoma","Oregon","Pennsylvania","Piedmont","Puerto Rico","Rhode Island","South Carolina","South Dakota","Tennessee","Texas","Utah","Vermont","Virgin Islands","Virginia","Washington","West Virginia","Wisconsin","Wyoming")
+    LANGS_ORDERED  : ClassVar[tuple[str, ...]] = ("", "ara","hrv","cze","dak","dan","eng","fin","fre","ger","ice","ita","lit","nob","pol","rum","slo","slv","spa","swe")
+    SORTS_ORDERED  : ClassVar[tuple[str, ...]] = ('relevance', 'state', 'title', 'date')
+    STATES : ClassVar[frozenset[str]] = frozenset(STATES_ORDERED)
+    LANGS  : ClassVar[frozenset[str]] = frozenset(LANGS_ORDERED)
+    SORTS  : ClassVar[frozenset[str]] = frozenset(SORTS_ORDERED)
     PARAMS : ClassVar[list[str]] = ['ortext', 'andtext', 'phrasetext', 'proxtext', 'proxdistance', 'state', 'lccn', 'dateFilterType', 'date1', 'date2', 'sequence', 'language', 'sort']
+    PARAM_SET : ClassVar[frozenset[str]] = frozenset(PARAMS)
+
+    __slots__ = (*PARAMS, 'max_results', 'n_results', 'results', '_results_lock', '_retrieved_pages', '_url', 'desc')
 
     def __init__(  
         self,
@@ -76,7 +119,7 @@ class ChronAmQuery:
         lccn: str  = '',
         dateFilterType: str  = 'yearRange',
         date1: date = date(1756, 1, 1),
-        date2: date = date.today(),
+        date2: Optional[date] = None,
         sequence: int  = 0,
         language: str  = '',
         sort: str = 'relevance',
@@ -89,9 +132,11 @@ class ChronAmQuery:
             return f'Query validation failed for attribute "{attr}": {msg}.'
 
         self.ortext, self.andtext, self.proxtext = ortext or [], andtext or [], proxtext or []
-        for term_attr in ('ortext', 'andtext', 'proxtext'):
-            if any(' ' in text for text in self.__getattribute__(term_attr)):
-                raise ValueError(get_error_msg(term_attr, 'spaces not allowed in search term lists'))
+        # check all terms in one pass; the offending list is only looked for once a space has been found
+        if any(' ' in text for text in chain(self.ortext, self.andtext, self.proxtext)):
+            for term_attr, terms in (('ortext', self.ortext), ('andtext', self.andtext), ('proxtext', self.proxtext)):
+                if any(' ' in text for text in terms):
+                    raise ValueError(get_error_msg(term_attr, 'spaces not allowed in search term lists'))
         
         self.phrasetext = phrasetext
 
@@ -104,12 +149,14 @@ class ChronAmQuery:
             state_fixed = self.state[0].upper() + self.state[1:].lower()
             if state_fixed not in ChronAmQuery.STATES:
                 raise ValueError(get_error_msg('state', f'{self.state} not recognized; see docs for list of acceptable values.'))
-            print(f'INFO: fixed attribute "state"; {self.state} -> {state_fixed}') 
+            logger.info('fixed attribute "state"; %s -> %s', self.state, state_fixed)
             self.state = state_fixed
 
         # this is not a full-fleshed lccn validator; it merely removes hyphens and checks for non-numeric characters
         self.lccn = lccn
-        lccn_fixed = self.lccn.replace('-', '').replace('sn', '')
+        lccn_fixed = self.lccn.translate(_LCCN_HYPHENS)
+        if 'sn' in lccn_fixed:
+            lccn_fixed = lccn_fixed.replace('sn', '')
         if not lccn_fixed and lccn_fixed.isnumeric():
             raise ValueError(get_error_msg('lccn', f'Library of Congress Control Numbers must contain only numeric characters'))
         if lccn_fixed != self.lccn:
@@ -119,12 +166,13 @@ class ChronAmQuery:
         if self.dateFilterType not in ('range', 'yearRange'):
             raise ValueError(get_error_msg('dateFilterType', f'must be one of "range" or "yearRange"'))
         
-        self.date1, self.date2 = date1, date2
-        for date_attr in ('date1', 'date2'):
-            if self.__getattribute__(date_attr) > date.today():
-                print(f'WARNING: date provided for attribute "{date_attr}" is in the future')
+        today = date.today()
+        self.date1, self.date2 = date1, date2 or today
+        for date_attr, value in (('date1', self.date1), ('date2', self.date2)):
+            if value > today:
+                logger.warning('date provided for attribute "%s" is in the future', date_attr)
         if self.date1 > self.date2:
-            print(f'WARNING: start date is after end date; query will return 0 results')
+            logger.warning('start date is after end date; query will return 0 results')
         
         self.sequence = sequence
         if self.sequence < 0:
@@ -138,27 +186,32 @@ class ChronAmQuery:
         
         self.sort = sort
         if self.sort not in ChronAmQuery.SORTS:
-            raise ValueError(f'Parameter "sort" must be one of "relevance", "state", "title", "data')
+            raise ValueError(get_error_msg('sort', 'must be one of "relevance", "state", "title", "date"'))
         
         self.max_results = max_results
         self.n_results = -1
         self.results: dict[int, str] = {}
         self._results_lock: Lock = Lock()
+        self._retrieved_pages: set[tuple[int, int]] = set()
         
         self.desc = desc or str(id(self))
 
     def __setattr__(self, name: str, value: Any) -> None:
-        """Resets results if query parameters are changed."""
-        if getattr(self, 'n_results', -1) != -1 and name in ChronAmQuery.PARAMS:
-            self.results.clear()
-            super().__setattr__('n_results', -1)
-            print(f'INFO: query parameter {name} changed, stored results cleared.')
+        """Resets results and the cached URL if query parameters are changed."""
+        # most assignments are to internal state, so the set lookup comes first and everything else falls straight through
+        if name in ChronAmQuery.PARAM_SET:
+            super().__setattr__('_url', None)
+            if getattr(self, 'n_results', -1) != -1:
+                self.results.clear()
+                self._retrieved_pages.clear()
+                super().__setattr__('n_results', -1)
+                logger.info('query parameter %s changed, stored results cleared.', name)
 
         super().__setattr__(name, value)
     
     def __str__(self) -> str:
         """Returns a string representation of the query."""
-        param_string = '\n'.join(f'\t{param}: {self.__getattribute__(param)}' for param in type(self).PARAMS)
+        param_string = '\n'.join(f'\t{param}: {getattr(self, param)}' for param in self.PARAMS)
         return f'{type(self).__name__}(\n\tdescription: "{self.desc}"\n{param_string}\n{self.results})'
     
     def __repr__(self) -> str:
@@ -166,19 +219,22 @@ class ChronAmQuery:
         return str(self)
     
     @staticmethod
-    def _parse_date(date: str, date_type: str, dateFilterType: str) -> date:
+    def _parse_date(date_str: str, date_type: str, dateFilterType: str) -> date:
             """Parses a string date into a `date` object depending on the `dateFilterType` and whether `date_type` is `'start'` or `'end'`."""
+            # the formats are fixed, so the fields are split out directly rather than with `strptime`
             if dateFilterType == 'yearRange':
+                year = int(unquote(date_str))
                 if date_type == 'start':
-                    return datetime.strptime(unquote(date), '%Y').date()
+                    return date(year, 1, 1)
                 elif date_type == 'end':
-                    return datetime.strptime(str(int(unquote(date)) + 1), '%Y').date() - timedelta(1)
+                    return date(year, 12, 31)
                 else:
                     raise ValueError(f'ERROR: date_type must be one of "start" or "end".')
             elif dateFilterType == 'range':
-                return datetime.strptime(unquote(date), '%m/%d/%Y').date()
+                month, day, year = unquote(date_str).split('/')
+                return date(int(year), int(month), int(day))
             else:
-                raise ValueError(f'ERROR: Failed to parse date {date} with dateFilterType {dateFilterType}.')
+                raise ValueError(f'ERROR: Failed to parse date {date_str} with dateFilterType {dateFilterType}.')
     
     @classmethod
     def from_url(cls, url: str) -> 'ChronAmQuery':
@@ -197,14 +253,7 @@ class ChronAmQuery:
 
         """
 
-        url = url.replace('https://chroniclingamerica.loc.gov/search/pages/results/?', '')
-        url = url.replace('#tab=tab_advanced_search', '')
-
-        try:
-            query_dict: dict[str, str] = {key: value for key, value in (param.split('=') for param in url.split('&'))}
-        except:
-            raise ValueError("Failed to parse URL params.")
-        
+        query_dict = _parse_search_url(url)
         if query_dict.get('searchType', '') != 'advanced':
             raise ValueError("This function only handles URLs from the Chronicling America advanced search at https://chroniclingamerica.loc.gov/#tab=tab_advanced_search. Use ChronAmBasicQuery for URLs from the basic search interface.")
 
@@ -212,13 +261,13 @@ class ChronAmQuery:
             query_dict.pop(key, None)
 
         return ChronAmQuery(
-            ortext       = [unquote(or_str) for or_str in query_dict.get('ortext', '').split('+')],
-            andtext      = [unquote(or_str) for or_str in query_dict.get('andtext', '').split('+')],
-            phrasetext   = unquote_plus(query_dict['phrasetext']),
-            proxtext     = [unquote(pro_str) for pro_str in query_dict.get('proxtext', '').split('+')],
+            ortext       = query_dict.get('ortext', '').split(),
+            andtext      = query_dict.get('andtext', '').split(),
+            phrasetext   = query_dict['phrasetext'],
+            proxtext     = query_dict.get('proxtext', '').split(),
             proxdistance = int(query_dict.get('proxdistance', '0')),
 
-            state          = unquote_plus(query_dict.get('state', '')),
+            state          = query_dict.get('state', ''),
             lccn           = query_dict.get('lccn', ''),
             dateFilterType = query_dict['dateFilterType'],
             date1          = cls._parse_date(query_dict['date1'], 'start', query_dict['dateFilterType']), 
@@ -232,91 +281,125 @@ class ChronAmQuery:
     
     @property
     def url(self) -> str:
-        """Returns a URL for retrieving JSON-formatted query results."""
+        """Returns a URL for retrieving JSON-formatted query results.
+
+        The URL is built on first access and cached until a query parameter is reassigned; modifying a search term list in place does not invalidate it.
+        """
+        url = getattr(self, '_url', None)
+        if url is None:
+            url = self._url = self._build_url()
+        return url
+
+    def _build_url(self) -> str:
+        """Builds the URL returned by `url` from the query parameters."""
+        date_format = URL_DATE_FORMATS[self.dateFilterType]
 
         url_params = {
-            'ortext': '+'.join(quote(or_str, safe='') for or_str in self.ortext),
-            'andtext': '+'.join(quote(and_str, safe='') for and_str in self.andtext),
+            'ortext': '+'.join(map(_quote_term, self.ortext)),
+            'andtext': '+'.join(map(_quote_term, self.andtext)),
             'phrasetext': quote_plus(self.phrasetext),
-            'proxtext': '+'.join(quote(pro_str, safe='') for pro_str in self.proxtext),
+            'proxtext': '+'.join(map(_quote_term, self.proxtext)),
             'proxdistance': str(self.proxdistance or ''),
 
             'state': quote_plus(self.state),
             'lccn': self.lccn,
             'dateFilterType': self.dateFilterType,
-            'date1': quote(self.date1.strftime('%Y') if self.dateFilterType == 'yearRange' else self.date1.strftime('%m/%d/%Y'), safe=''),
-            'date2': quote(self.date2.strftime('%Y') if self.dateFilterType == 'yearRange' else self.date2.strftime('%m/%d/%Y'), safe=''),
+            'date1': self.date1.strftime(date_format),
+            'date2': self.date2.strftime(date_format),
             'sequence': str(self.sequence or ''),
             'language': self.language,
             'sort': self.sort,
-
-            'format': 'json',
-            'searchType': 'advanced'
         }
 
-        return SEARCH_URL_BASE + '&'.join(f'{key}={value}' for key, value in (url_params).items())
+        return SEARCH_URL_BASE + '&'.join(f'{key}={value}' for key, value in url_params.items()) + SEARCH_URL_TAIL
     
     @property
     def ids(self) -> list[str]:
         """Returns a list of ids corresponding to a digitized newspaper page in the Chronicling America database."""
         return list(self.results.values())
     
-    def retrieve_page(self, page: int, page_size: int, limiter: ChronAmRateLimiter) -> int:
+    def retrieve_page(self, page: int, page_size: int, limiter: ChronAmRateLimiter, cache: Optional[ChronAmPageCache]=None, session: Optional[requests.Session]=None) -> int:
         """Downloads, decodes and records a single page of query results.
         
         Arguments:
-            page      (int)                : the page number (indexed from 1) to retrieve.
-            page_size (int)                : the number of results per page.
-            limiter   (ChronAmRateLimiter) : an object storing timestamps to prevent rate limiting from the API.
+            page      (int)                     : the page number (indexed from 1) to retrieve.
+            page_size (int)                     : the number of results per page.
+            limiter   (ChronAmRateLimiter)      : an object storing timestamps to prevent rate limiting from the API.
+            cache     (ChronAmPageCache | None) : an optional cache to read the page from and write it to.
+            session   (requests.Session | None) : an optional session to make the request with; defaults to a session shared by all queries.
         
         Returns:
             _ (int) : the total number items written to `result`.
         
         Raises:
-            ValueError      : if downloading or JSON decoding fails.
-            ConnectionError : if no connection can be established to the host at loc.gov.
+            ValueError : if downloading or JSON decoding fails; transport failures such as timeouts and dropped connections are raised as ValueError too,
+                         so that `retrieve_page_with_retry` in `retrieve_all` retries them like any other failed download.
         
         """
 
         page_url = f'{self.url}&page={page}&rows={page_size}'
-        
-        try:
-            response = limiter.submit(requests.get, page_url)
-            response.raise_for_status()
-        except requests.exceptions.HTTPError:
-            raise ValueError(f'ERROR: download for {page_url} failed with code {response.status_code}')
-        except ConnectionError:
-            raise ConnectionError(f'ERROR: failed to establish connection with the host at loc.gov.')
-        
-        try:
-            response_json = response.json()
-        except ValueError:
-            raise ValueError(f'ERROR: failed to parse JSON for {page_url}.')
-        
-        for exp_prop, exp_type in [('totalItems', int), ('endIndex', int), ('startIndex', int), ('items', list)]:
-            if exp_prop not in response_json or type(response_json[exp_prop]) is not exp_type:
-                raise ValueError(f'ERROR: unrecognized JSON response format for {page_url}.')
+
+        response_json = cache.get(page_url) if cache else None
+        if response_json is not None:
+            logger.info('read page %d of query "%s" from cache.', page, self.desc)
+        else:
+            # a stale cached page is revalidated rather than downloaded again, if the API sent validators for it
+            headers = cache.conditional_headers(page_url) if cache else {}
+            try:
+                response = limiter.submit((session or _session).get, page_url, headers=headers or None, timeout=SEARCH_TIMEOUT)
+                response.raise_for_status()
+            except requests.exceptions.HTTPError:
+                raise ValueError(f'ERROR: download for {page_url} failed with code {response.status_code}')
+            except requests.exceptions.RequestException as e:
+                # timeouts and dropped connections are retried by `retrieve_page_with_retry` like any other failed download
+                raise ValueError(f'ERROR: request for {page_url} failed: {e}')
+
+            if headers and response.status_code == 304:
+                response_json = cache.get(page_url, allow_stale=True)
+                if response_json is None:
+                    raise ValueError(f'ERROR: cached page for {page_url} was removed during revalidation.')
+                cache.refresh(page_url)
+                logger.info('page %d of query "%s" not modified; read from cache.', page, self.desc)
+            else:
+                try:
+                    response_json = loads(response.content)
+                except ValueError:
+                    raise ValueError(f'ERROR: failed to parse JSON for {page_url}.')
+
+                for exp_prop, exp_type in [('totalItems', int), ('endIndex', int), ('startIndex', int), ('items', list)]:
+                    if exp_prop not in response_json or type(response_json[exp_prop]) is not exp_type:
+                        raise ValueError(f'ERROR: unrecognized JSON response format for {page_url}.')
+
+                if cache:
+                    cache.put(page_url, response_json, response.headers.get('ETag'), response.headers.get('Last-Modified'))
 
         if self.n_results == -1:
-            print(f'INFO: found {response_json["totalItems"]} results for query {self.desc}')
+            logger.info('found %d results for query %s', response_json['totalItems'], self.desc)
             if self.max_results == 0:
                 self.n_results = response_json['totalItems']
             else:
                 self.n_results = min(self.max_results, response_json['totalItems'])
 
-        written = 0
+        # items are in index order, so anything past `max_results` is trimmed with a single slice
+        start, items = response_json['startIndex'], response_json['items']
+        if self.max_results:
+            items = items[:max(0, self.max_results - start + 1)]
+
+        # pages cover disjoint indices, so each is collected without the lock and merged in a single update
+        page_results = {
+            index: id[6:] if (id := item['id']).startswith('/lccn/') else id
+            for index, item in enumerate(items, start)
+        }
         with self._results_lock:
-            for i, item in enumerate(response_json['items']):
-                index = i + response_json['startIndex']
-                if not self.max_results or index <= self.max_results:
-                    self.results[index] = item['id'].replace('/lccn/', '') 
-                    written += 1
+            self.results.update(page_results)
+            self._retrieved_pages.add((page, page_size))
+        written = len(page_results)
 
-        print(f'INFO: updated query "{self.desc}" with {written} items.')
+        logger.info('updated query "%s" with %d items.', self.desc, written)
             
         return written
     
-    def retrieve_all(self, page_size: int, limiter: ChronAmRateLimiter, executor: Optional[ThreadPoolExecutor]=None, n_retries: int = 3, overwrite: bool = False):
+    def retrieve_all(self, page_size: int, limiter: ChronAmRateLimiter, executor: Optional[ThreadPoolExecutor]=None, n_retries: int = 3, overwrite: bool = False, cache: Optional[ChronAmPageCache]=None, session: Optional[requests.Session]=None):
         """Populates `result` with newspaper page IDs by running a [Chronicling America advanced search](https://chroniclingamerica.loc.gov/#tab=tab_advanced_search).
 
         Arguments:
@@ -325,6 +408,8 @@ class ChronAmQuery:
             executor     (ThreadPoolExecutor | None) : an optional executor for executing page retrievals concurrently.
             n_retries    (int)                       : the number of times per page to retry failed download and decoding.
             overwrite    (bool)                      : if True, overwrite pages that have already been retrieved.
+            cache        (ChronAmPageCache | None)   : an optional cache to read pages from and write them to.
+            session      (requests.Session | None)   : an optional session to make requests with; defaults to a session shared by all queries.
 
         Returns:
             _ (int) : the total number of items written to `result`.
@@ -332,15 +417,18 @@ class ChronAmQuery:
         Raises:
             ValueError : if page download and decoding fails after `n_retries` attempts.
 
+        Page retrieval is network-bound but throttled by `limiter` to the loc.gov limit of 20 requests per minute, so an
+        executor with a handful of workers is enough to keep the limit saturated; more workers will only wait on `limiter`.
+
         """
 
         def retrieve_page_with_retry(page: int) -> int:
             """Retrieves page `page` with `n_retries` attempts."""
             for i in range(n_retries):
                 try:
-                    return self.retrieve_page(page, page_size, limiter)
+                    return self.retrieve_page(page, page_size, limiter, cache, session)
                 except ValueError as e:
-                    print(f'ERROR: download for query "{self.desc}" page {page} failed; {n_retries - i - 1} attempts remaining.')
+                    logger.error('download for query "%s" page %d failed; %d attempts remaining.', self.desc, page, n_retries - i - 1)
                     msg = str(e)
             
             raise ValueError(msg)
@@ -351,51 +439,101 @@ class ChronAmQuery:
         if self.n_results == -1:
             written = retrieve_page_with_retry(1)
             page = 2
-            remaining = self.n_results - page_size
-        else:
-            remaining = self.n_results
-        
-        while remaining is None or remaining > 0:
-            indices = range(page_size * (page - 1) + 1, min(self.max_results, page_size * page  + 1))
-            is_full = all(self.results.get(index, '') for index in indices if index <= self.n_results)
+
+        # `n_results` is already capped at `max_results`, so it alone determines the last page
+        for page in range(page, -(-self.n_results // page_size) + 1):
+            # pages retrieved this session are recorded directly; results loaded by other means are checked index by index
+            if (page, page_size) in self._retrieved_pages:
+                is_full = True
+            else:
+                indices = range(page_size * (page - 1) + 1, min(self.n_results, page_size * page) + 1)
+                is_full = all(self.results.get(index, '') for index in indices)
 
             if is_full and not overwrite:
-                print(f'INFO: page {page} already present for query "{self.desc}."')
+                logger.info('page %d already present for query "%s."', page, self.desc)
+            elif executor:
+                workers.append(executor.submit(retrieve_page_with_retry, page))
             else:
-                if executor:
-                    workers.append(executor.submit(retrieve_page_with_retry, page))
-                else:
-                    written += retrieve_page_with_retry(page)
-            
-            page += 1
-            remaining -= page_size
+                written += retrieve_page_with_retry(page)
         
         if executor:
             return written + sum(worker.result() for worker in as_completed(workers))
         else:
             return written
 
-    def dump_json(self, filepath: str) -> None:
-        """Writes the query results to `filepath` as JSON."""
-        with open(filepath, 'w') as fp:
-            dump(self.results, fp, indent=4)
+    def dump_json(self, filepath: str, indent: Optional[int]=None) -> None:
+        """Writes the query results to `filepath` as JSON, indented by `indent` spaces if provided and compact otherwise."""
+        write_json(self.results, filepath, indent)
 
     def dump_txt(self, filepath: str) -> int:
         """Writes the query results to a text file as a newline-separated list of IDs. Returns the number of IDs written."""
         with open(filepath, 'w') as fp:
             return sum(bool(fp.write(f'{id}\n')) for id in self.results.values())
 
+    def cached_path(self, cache_dir: str) -> str:
+        """Returns the path in `cache_dir` that `save_cached` writes this query's results to, keyed on its URL and `max_results`."""
+        key = blake2b(f'{self.url}&max_results={self.max_results}'.encode(), digest_size=16).hexdigest()
+        return path.join(cache_dir, f'{key}.json')
+
+    def save_cached(self, cache_dir: str) -> str:
+        """Writes `results` and `n_results` to a file in `cache_dir` so that `load_cached` can restore them in a later session. Returns the path written."""
+        filepath = self.cached_path(cache_dir)
+
+        # write to a temporary file first so that a concurrent `load_cached` never sees partial results
+        dump_atomic({'n_results': self.n_results, 'results': self.results}, filepath)
+
+        return filepath
+
+    def load_cached(self, cache_dir: str, max_age: float = 86400) -> bool:
+        """Restores `results` and `n_results` from a file written by `save_cached` for the same parameters.
+
+        Arguments:
+            cache_dir (str)   : the directory passed to `save_cached`.
+            max_age   (float) : the number of seconds after which saved results are considered stale; `0` to never expire.
+
+        Returns:
+            _ (bool) : whether fresh results were found and loaded; False if the file is missing, stale, or malformed.
+
+        """
+        filepath = self.cached_path(cache_dir)
+        try:
+            if max_age and time() - path.getmtime(filepath) > max_age:
+                return False
+            with open(filepath, 'r') as fp:
+                cached = load(fp)
+        except (OSError, ValueError):
+            return False
+
+        # JSON object keys are always strings, so the result indices are converted back; files of any other shape are treated as missing
+        try:
+            results = {int(index): id for index, id in cached['results'].items()}
+            n_results = int(cached['n_results'])
+        except (KeyError, TypeError, AttributeError, ValueError):
+            logger.warning('ignoring malformed cached results at %s.', filepath)
+            return False
+
+        with self._results_lock:
+            self.results.clear()
+            self._retrieved_pages.clear()
+            self.results.update(results)
+        self.n_results = n_results
+
+        logger.info('loaded %d cached results for query "%s".', len(self.results), self.desc)
+        return True
+
 class ChronAmBasicQuery(ChronAmQuery):
     """A subclass of `ChronAmQuery` that instead uses the more limited [Chronicling America Basic Search](https://chroniclingamerica.loc.gov/#tab=tab_search)."""
     
     PARAMS : ClassVar[list[str]] = ['state', 'date1', 'date2', 'proxtext']
 
+    __slots__ = ()
+
     def __init__(
             self, 
             state: str = '', 
             date1: str = '1756',
-            date2: str = date.today().strftime('%Y'),
-            proxtext: list[str] = [],
+            date2: Optional[str] = None,
+            proxtext: Optional[list[str]] = None,
             sort: str = 'relevance',
             max_results: int = 0,
             desc: str =''
@@ -403,9 +541,9 @@ class ChronAmBasicQuery(ChronAmQuery):
         """Initializes the object using the `ChronAmQuery` initializer with only basic parameters specified.
         
         Arguments:
-            state    (str)       : a U.S. state or territory; see the `STATES` class variable for a list of acceptable values.
+            state    (str)       : a U.S. state or territory; see the `STATES_ORDERED` class variable for a list of acceptable values.
             date1    (str)       : a four-character string representing the year to start the search, e.g. '1903.'
-            date2    (str)       : a four-character string representing the year to end the search, e.g. '1917.'
+            date2    (str)       : a four-character string representing the year to end the search, e.g. '1917'; defaults to the current year.
             proxtext (list[str]) : a list of single-word search terms.
             sort     (str)       : determines ordering of search results; one of 'relevance', 'state', 'title', 'date'.
             max_results (int)    : the maximum number of IDs to retrieve; `0` to retrieve all.
@@ -413,8 +551,8 @@ class ChronAmBasicQuery(ChronAmQuery):
 
         """
         try:
-            parsed_date1 = super(type(self), type(self))._parse_date(date1, 'start', 'yearRange')
-            parsed_date2 = super(type(self), type(self))._parse_date(date2, 'end', 'yearRange')
+            parsed_date1 = ChronAmQuery._parse_date(date1, 'start', 'yearRange')
+            parsed_date2 = ChronAmQuery._parse_date(date2 or date.today().strftime('%Y'), 'end', 'yearRange')
         except ValueError:
             raise ValueError(f'ERROR: Failed to parse dates ({date1}, {date2}).')
 
@@ -437,14 +575,7 @@ class ChronAmBasicQuery(ChronAmQuery):
 
         """
 
-        url = url.replace('https://chroniclingamerica.loc.gov/search/pages/results/?', '')
-        url = url.replace('#tab=tab_search', '')
-
-        try:
-            query_dict: dict[str, str] = {key: value for key, value in (param.split('=') for param in url.split('&'))}
-        except:
-            raise ValueError("Failed to parse URL params.")
-        
+        query_dict = _parse_search_url(url)
         if query_dict.get('searchType', '') != 'basic':
             raise ValueError("This function only handles URLs from the Chronicling America basic search at https://chroniclingamerica.loc.gov/#tab=tab_search. Use ChronAmQuery for URLs from the advanced search interface.")
 
@@ -452,30 +583,26 @@ class ChronAmBasicQuery(ChronAmQuery):
             query_dict.pop(key, None)
 
         return ChronAmBasicQuery(
-            proxtext    = [unquote(pro_str) for pro_str in query_dict.get('proxtext', '').split('+')],
-            state       = unquote_plus(query_dict.get('state', '')),
+            proxtext    = query_dict.get('proxtext', '').split(),
+            state       = query_dict.get('state', ''),
             date1       = query_dict['date1'],
             date2       = query_dict['date2'],
             sort        = query_dict.get('sort', 'relevance'),
             max_results = 50
         )
 
-    @property
-    def url(self) -> str:
-        """Returns a URL for retrieving JSON-formatted query results."""
+    def _build_url(self) -> str:
+        """Builds the URL returned by `url` from the basic search parameters."""
 
         url_params = {
-            'proxtext': '+'.join(quote(pro_str, safe='') for pro_str in self.proxtext),
+            'proxtext': '+'.join(map(_quote_term, self.proxtext)),
             'state': quote_plus(self.state),
             'dateFilterType': self.dateFilterType,
-            'date1': quote(self.date1.strftime('%m/%d/%Y'), safe=''),
-            'date2': quote(self.date2.strftime('%m/%d/%Y'), safe=''),
-
-            'format': 'json',
-            'searchType': 'advanced'
+            'date1': self.date1.strftime(URL_DATE_FORMATS['range']),
+            'date2': self.date2.strftime(URL_DATE_FORMATS['range']),
         }
 
-        return SEARCH_URL_BASE + '&'.join(f'{key}={value}' for key, value in (url_params).items())
+        return SEARCH_URL_BASE + '&'.join(f'{key}={value}' for key, value in url_params.items()) + SEARCH_URL_TAIL
 
 class ChronAmMultiQuery:
     """Handles rate limiting and concurrency for multiple ChronAmQuery instances.
@@ -483,39 +610,124 @@ class ChronAmMultiQuery:
     Attributes:
         queries  (list[ChronAmQuery])        : a list of ChronAmQuery objects for defining query paremeters and storing results.
         limiter  (ChronAmRateLimiter)        : an object storing timestamps to prevent rate limiting from the API.
-        executor (ThreadPoolExecutor | None) : an optional executor for executing page retrievals concurrently.
+        executor (ThreadPoolExecutor)        : an executor for executing page retrievals concurrently; one with `max_workers` workers is created if none is provided.
+        max_workers (int)                    : the number of workers in `executor`, which sizes the connection pool of `session`; defaults to `DEFAULT_WORKERS`.
+        max_query_threads (int)              : the number of queries `retrieve_all` runs at once, `QUERY_THREADS_PER_WORKER` per worker.
+        cache    (ChronAmPageCache | None)   : an optional cache to read pages from and write them to.
+        session  (requests.Session)          : a session shared by all queries so that connections to loc.gov are kept alive and reused.
+        _owns_executor (bool)                : whether `executor` was created by this object and should be shut down by `close`.
+        _prewarming (dict[int, Future[int]]) : first-page retrievals started by `prewarm` that `retrieve_all` has not yet waited on, keyed by the `id` of their query.
+
+    Use the object as a context manager, or call `close`, to shut down an executor it created.
     
     """
 
-    def __init__(self, queries: list[ChronAmQuery], limiter: ChronAmRateLimiter, executor: Optional[ThreadPoolExecutor] = None):
+    # page retrievals are throttled to the loc.gov rate limit, so a few workers are enough to keep it saturated
+    DEFAULT_WORKERS: ClassVar[int] = 4
+    # queries run by `retrieve_all` at once per worker; each of their threads mostly waits on its pages, so there can be more of them than workers
+    QUERY_THREADS_PER_WORKER: ClassVar[int] = 4
+
+    def __init__(self, queries: list[ChronAmQuery], limiter: ChronAmRateLimiter, executor: Optional[ThreadPoolExecutor] = None, cache: Optional[ChronAmPageCache] = None, session: Optional[requests.Session] = None, max_workers: int = DEFAULT_WORKERS):
         self.queries  = queries
         self.limiter  = limiter
+        self.cache    = cache
+        self.max_workers = max_workers
+        self.max_query_threads = ChronAmMultiQuery.QUERY_THREADS_PER_WORKER * max_workers
+
+        self._owns_executor = executor is None
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=max_workers)
         self.executor = executor
+
+        self.session  = session if session is not None else make_session(max_workers)
+
+        self._prewarming: dict[int, Future[int]] = {}
     
     def __getitem__(self, index) -> ChronAmQuery:
         """Allows indexing for retrieval of individual queries."""
         return self.queries[index]
+
+    def __enter__(self) -> 'ChronAmMultiQuery':
+        """Allows use as a context manager; see `close`."""
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        """Calls `close` on leaving the context."""
+        self.close()
+
+    def close(self) -> None:
+        """Shuts down `executor` if it was created by this object."""
+        if self._owns_executor:
+            self.executor.shutdown()
     
     def retrieve_all(self, page_size: int, n_retries: int=3, overwrite: bool=False) -> int:
-        """Retrieves and stores results for all queries, returns the total number of items written."""
-        return sum(query.retrieve_all(page_size, self.limiter, self.executor, n_retries, overwrite) for query in self.queries)
+        """Retrieves and stores results for all queries, returns the total number of items written.
 
-    def dump_json(self, filepath: str) -> None:
-        """Writes the query results to `filepath` as JSON."""
-        with open(filepath, 'w') as fp:
-            dump({ query.desc: query.results for query in self.queries }, fp, indent=4)
+        Queries are retrieved concurrently rather than one after another. Each query waits on its own pages,
+        so queries are run from separate threads and only their pages are submitted to `self.executor`; otherwise a query could occupy every worker
+        while waiting on pages that have no worker left to run them. At most `max_query_threads` queries are run at once.
+        A query with a first page still pending from `prewarm` waits on it rather than requesting the page again.
+        """
+        def retrieve_query(query: ChronAmQuery) -> int:
+            written = 0
+            prewarming = self._prewarming.pop(id(query), None)
+            if prewarming is not None:
+                try:
+                    written = prewarming.result()
+                except ValueError as e:
+                    # `n_results` is still unknown, so `retrieve_all` retries the first page itself
+                    logger.warning('prewarming query "%s" failed: %s', query.desc, e)
+
+            return written + query.retrieve_all(page_size, self.limiter, self.executor, n_retries, overwrite, self.cache, self.session)
+
+        if len(self.queries) < 2:
+            return sum(retrieve_query(query) for query in self.queries)
+
+        with ThreadPoolExecutor(max_workers=min(len(self.queries), self.max_query_threads)) as query_executor:
+            workers = [query_executor.submit(retrieve_query, query) for query in self.queries]
+            return sum(worker.result() for worker in as_completed(workers))
+
+    def prewarm(self, page_size: int) -> list[Future[int]]:
+        """Starts retrieving the first page of every query that has not been run yet, without waiting for the results.
+
+        This can be called right after construction, e.g. at the start of a notebook, so that the number of results and the first page of each query
+        are already stored, and in `self.cache` if one is set, by the time they are needed; a later `retrieve_all` with the same `page_size` then skips these pages.
+        The futures are kept in `_prewarming` so that `retrieve_all` waits on any that are still pending instead of requesting the same pages again.
+        Queries that are already being prewarmed are skipped.
+
+        Arguments:
+            page_size (int) : the number of results per page; should match the `page_size` later passed to `retrieve_all`.
+
+        Returns:
+            _ (list[Future[int]]) : one future per page submitted, resolving to the number of items written; call `result()` to surface errors.
+
+        """
+        futures = []
+        for query in self.queries:
+            if query.n_results == -1 and id(query) not in self._prewarming:
+                future = self.executor.submit(query.retrieve_page, 1, page_size, self.limiter, self.cache, self.session)
+                self._prewarming[id(query)] = future
+                futures.append(future)
+
+        return futures
+
+    def dump_json(self, filepath: str, indent: Optional[int]=None) -> None:
+        """Writes the query results to `filepath` as JSON, indented by `indent` spaces if provided and compact otherwise."""
+        write_json({ query.desc: query.results for query in self.queries }, filepath, indent)
 
     def dump_txt(self, filepath: str, allow_duplicates: bool=True) -> int:
-        """Writes the query results to a text file as a newline-separated list of IDs, omitting duplicates if `allow_duplicates=True`. Returns the number of IDs written."""
-        written = set()
-        with open(filepath, 'w') as fp:
-            for query in self.queries:
-                for id in query.results.values():
-                    if not allow_duplicates and query in set():
+        """Writes the query results to a text file as a newline-separated list of IDs, omitting duplicates if `allow_duplicates=False`. Returns the number of IDs written."""
+        ids, seen = [], set()
+        for query in self.queries:
+            for id in query.results.values():
+                if not allow_duplicates:
+                    if id in seen:
                         continue
-                    else:
-                        fp.write(f'{id}\n')
-                        written.add(id)
-            
-            return len(written)
+                    seen.add(id)
+                ids.append(id)
+
+        # build the file contents up front so they are written in one call
+        with open(filepath, 'w') as fp:
+            fp.write(''.join(f'{id}\n' for id in ids))
 
+        return len(ids)
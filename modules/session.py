@@ -0,0 +1,12 @@
+import requests
+from requests.adapters import HTTPAdapter
+
+def make_session(pool_size: int = 10) -> requests.Session:
+    """Returns a session for requests to loc.gov that keeps up to `pool_size` connections alive.
+
+    Pass the number of workers making requests through the session as `pool_size` so that no worker has to open a fresh connection.
+    The session makes no retries of its own; callers retry failed pages and files themselves.
+    """
+    session = requests.Session()
+    session.mount('https://', HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0))
+    return session